@@ -1,11 +1,29 @@
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy.misc import imread
-from scipy.signal import convolve2d as c2d
-from scipy.ndimage.filters import convolve
-import skimage.color as sk
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+import functools
+import math
 import os
 
+try:  # without scipy the 1D filters fall back to pure numpy, see _correlate1d_numpy
+    from scipy import ndimage
+except ImportError:
+    ndimage = None
+
+try:  # optional, used for the fused polyphase kernels
+    import numba
+except ImportError:
+    numba = None
+
+try:  # optional, runs the pyramids on the gpu
+    import cupy
+    import cupyx.scipy.ndimage as cupy_ndimage
+except ImportError:
+    cupy = None
+
 # ---- constants ---- #
 LOWEST_RES = 16
 # ------------------- #
@@ -13,50 +31,68 @@ LOWEST_RES = 16
 
 def build_gaussian_pyramid(im, max_levels, filter_size):
     """
-    :param im: a grayscale image with double values in [0, 1]
+    :param im: a grayscale image with float32 values in [0, 1]
     :param max_levels:  the maximal number of levels in the resulting pyramid
     :param filter_size:  the size of the Gaussian filter to be used
     in constructing the pyramid filter .
     :return: pyr: a standard python array with maximum length of max_levels, where each element of the
     array is a grayscale.
-    :return: filter_vec: 1D-row of size filter_size used for the pyramid construction.
+    :return: filter_vec: 1D array (not a row matrix) of size filter_size used for the pyramid
+    construction.
     """
-    pyr = [im]  # to hold re-sized images
-    rows, cols = im.shape[0], im.shape[1]
     filter_vec = make_filter_to_size(filter_size)  # make filter in size
-    for i in range(1, max_levels):
-        resize_factor = 2 ** i
-        if rows / resize_factor > LOWEST_RES or cols / resize_factor > LOWEST_RES:
-            # blurs and reduce image to half in each dim.
-            pyr.append(reduce_image(im, filter_vec, i))
-        else:  # got to lowest resolution allowed
-            return pyr, filter_vec
+    # deepest level keeping both dims at least LOWEST_RES, bit_length is 1 + floor(log2)
+    depth = min(max_levels, max(1, (min(im.shape[0], im.shape[1]) // LOWEST_RES).bit_length()))
+    pyr = list(gaussian_levels(im, filter_vec, depth))  # to hold re-sized images
     return pyr, filter_vec
 
 
+def gaussian_levels(im, filter_vec, depth):
+    """
+    generate the levels of a gaussian pyramid one by one, so a consumer can drop each level once used
+    :param im: the first level
+    :param filter_vec: vector to blur by it
+    :param depth: the number of levels to generate
+    """
+    cur = im
+    yield cur
+    for i in range(1, depth):
+        # blurs and reduce previous level to half in each dim.
+        cur = reduce_image(cur, filter_vec)
+        yield cur
+
+
 def build_laplacian_pyramid(im, max_levels, filter_size):
     """
-    :param im: a grayscale image with double values in [0, 1]
+    :param im: a grayscale image with float32 values in [0, 1]
     :param max_levels:  the maximal number of levels in the resulting pyramid
     :param filter_size:  the size of the Gaussian filter to be used
     in constructing the pyramid filter .
     :return: pyr: a standard python array with maximum length of max_levels, where each element of the
     array is a grayscale.
-    :return: filter_vec: 1D-row of size filter_size used for the pyramid construction.
+    :return: filter_vec: 1D array (not a row matrix) of size filter_size used for the pyramid
+    construction.
     """
     # make gaussian pyramid
     g_pyr, filter_vec = build_gaussian_pyramid(im, max_levels, filter_size)
-    # initial laplacian pyramid
-    l_pyr = []
+    xp = get_backend(im)[0]
+    # initial laplacian pyramid, as deep as the gaussian one which may stop before max_levels
+    l_pyr = [None] * len(g_pyr)
+    # one expand buffer for all levels below the first, smaller levels use its top left corner
+    scratch = xp.empty_like(g_pyr[1]) if len(g_pyr) > 2 else None
 
     # calculate the laplacian level
-    for i in range(max_levels - 1):
-        expanded = expand_image(g_pyr[i + 1], filter_vec)
-        l_im = g_pyr[i] - expanded
-        l_pyr.append(l_im)
-
-    # add last level image
-    l_pyr.append(g_pyr[-1])
+    for i in range(len(g_pyr) - 1):
+        rows, cols = g_pyr[i].shape[0], g_pyr[i].shape[1]
+        if i == 0:  # the first level is the input image itself, so it gets its own buffer
+            expanded = l_im = xp.empty_like(g_pyr[0])
+        else:  # the gaussian level is not needed anymore, it becomes the laplacian level
+            expanded, l_im = scratch[:rows, :cols], g_pyr[i]
+        expand_image(g_pyr[i + 1], filter_vec, out=expanded)
+        l_pyr[i] = xp.subtract(g_pyr[i], expanded, out=l_im)
+
+    # add last level image, copied if it is the input itself so the pyramid never shares its memory
+    l_pyr[-1] = g_pyr[-1] if len(g_pyr) > 1 else g_pyr[0].copy()
 
     return l_pyr, filter_vec
 
@@ -74,9 +110,13 @@ def laplacian_to_image(lpyr, filter_vec, coeff):
     r_img = lpyr[-1] * coeff[-1]
 
     # do opposite process of make laplacian pyr, meaning expand image and add to previous level
-    levels = len(lpyr) - 2  # start iterate from second level from the end
-    for i in range(levels + 1):
-        r_img = (lpyr[levels - i] * coeff[levels - i]) + expand_image(r_img, filter_vec)
+    xp = get_backend(r_img)[0]
+    scaled = xp.empty_like(lpyr[0])  # smaller levels use its top left corner
+    for k in range(len(lpyr) - 2, -1, -1):  # start iterate from second level from the end
+        rows, cols = lpyr[k].shape[0], lpyr[k].shape[1]
+        xp.multiply(lpyr[k], coeff[k], out=scaled[:rows, :cols])
+        expanded = expand_image(r_img, filter_vec, out=xp.empty_like(lpyr[k]))
+        r_img = xp.add(expanded, scaled[:rows, :cols], out=expanded)
     return r_img
 
 
@@ -92,15 +132,17 @@ def render_pyramid(pyr, levels):
     levels = min(levels, len(pyr))
     pyr_h = pyr[0].shape[0]
     pyr_w = sum(pyr[i].shape[1] for i in range(levels))
-    res = np.zeros([pyr_h, pyr_w]).astype(np.float64)
+    res = np.zeros((pyr_h, pyr_w) + pyr[0].shape[2:], dtype=np.float32)
 
     # stack images
     marker = 0
     for i in range(levels):
         v_max, h_max = pyr[i].shape[0], pyr[i].shape[1]
-        # input image and normalize
-
-        res[0:v_max, marker:(marker + h_max)] = norm_pyramid(pyr[i])
+        # input image and normalize straight into its place, pyramid values are finite
+        level = res[0:v_max, marker:(marker + h_max)]
+        min_pixel, max_pixel = pyr[i].min(), pyr[i].max()
+        np.subtract(pyr[i], min_pixel, out=level)
+        level *= 1 / (max_pixel - min_pixel)
         marker = marker + h_max
 
     return res
@@ -122,8 +164,8 @@ def display_pyramid(pyr, levels):
 
 def pyramid_blending(im1, im2, mask, max_levels, filter_size_im, filter_size_mask):
     """
-    :param im1:  input grayscale image to be blended.
-    :param im2:  input grayscale image to be blended.
+    :param im1:  input grayscale image to be blended, or an RGB image of shape (rows, cols, 3).
+    :param im2:  input grayscale image to be blended, same shape as im1.
     :param mask: is a boolean mask containing True and False representing which parts of im1 and im2
     should appear in the blended image
     :param max_levels: is the max_levels parameter to use when generating the Gaussian and Laplacian
@@ -134,19 +176,51 @@ def pyramid_blending(im1, im2, mask, max_levels, filter_size_im, filter_size_mas
     construction of the Gaussian pyramid of mask.
     :return: im_blend: Implemented pyramid blending as described in the lecture
     """
-
-    # initialize pyramids
-    lpyr_1, filter_vec_1 = build_laplacian_pyramid(im1, max_levels, filter_size_im)
-    lpyr_2, filter_vec_2 = build_laplacian_pyramid(im2, max_levels, filter_size_im)
-    g_m, garbage_vec = build_gaussian_pyramid(mask.astype(np.float64), max_levels, filter_size_mask)
-    # blend as shown on ex.
-    L_out = [0] * len(lpyr_1)
-    for k in range(len(lpyr_1)):
-        L_out[k] = (g_m[k] * lpyr_1[k])  + ((1 - g_m[k]) * lpyr_2[k])
+    # work in float32, arrays that already are float32 are used without a copy
+    xp = get_backend(im1)[0]
+    im1, im2 = xp.asarray(im1, dtype=np.float32), xp.asarray(im2, dtype=np.float32)
+    mask = xp.asarray(mask, dtype=np.float32)
+
+    # initialize pyramids. the numba kernels already spread each pass over all cores and must run on
+    # the main thread (numba's tbb layer hangs at exit otherwise), so only the scipy path uses threads
+    if numba is not None:
+        lpyr_1, filter_vec_1 = build_laplacian_pyramid(im1, max_levels, filter_size_im)
+        lpyr_2, filter_vec_2 = build_laplacian_pyramid(im2, max_levels, filter_size_im)
+    else:  # independent, so build them side by side
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            job_1 = executor.submit(build_laplacian_pyramid, im1, max_levels, filter_size_im)
+            job_2 = executor.submit(build_laplacian_pyramid, im2, max_levels, filter_size_im)
+            lpyr_1, filter_vec_1 = job_1.result()
+            lpyr_2, filter_vec_2 = job_2.result()
+
+    # the mask levels are generated while blending, only one of them is alive at a time
+    g_m = gaussian_levels(mask, make_filter_to_size(filter_size_mask), len(lpyr_1))
+    L_out = blend_pyramids(lpyr_1, lpyr_2, g_m)
 
     # transform to image and clip
-    im_blend = laplacian_to_image(L_out, filter_vec_1, np.ones(len(lpyr_1)))
-    return np.clip(im_blend, 0, 1)
+    im_blend = laplacian_to_image(L_out, filter_vec_1, np.ones(len(lpyr_1), dtype=np.float32))
+    return get_backend(im_blend)[0].clip(im_blend, 0, 1)
+
+
+def blend_pyramids(lpyr_1, lpyr_2, g_m):
+    """
+    blend two laplacian pyramids level by level, weighted by the mask gaussian pyramid.
+    the levels of both pyramids are used as scratch and overwritten
+    :param lpyr_1: laplacian pyramid of first image
+    :param lpyr_2: laplacian pyramid of second image
+    :param g_m: gaussian pyramid of the mask or an iterator over its levels, broadcast over any
+    channel axis of the images
+    :return: L_out: the blended laplacian pyramid
+    """
+    # blend as shown on ex, g * l1 + (1 - g) * l2 == l2 + g * (l1 - l2)
+    xp = get_backend(lpyr_1[0])[0]
+    L_out = [0] * len(lpyr_1)
+    for k, g in enumerate(g_m):
+        g = g.reshape(g.shape + (1,) * (lpyr_1[k].ndim - g.ndim))
+        diff = xp.subtract(lpyr_1[k], lpyr_2[k], out=lpyr_1[k])
+        xp.multiply(g, diff, out=diff)
+        L_out[k] = xp.add(lpyr_2[k], diff, out=lpyr_2[k])
+    return L_out
 
 
 def blending_example1():
@@ -156,7 +230,7 @@ def blending_example1():
     # read images
     im1 = read_image(relpath('externals/im4.jpg'), 2)
     im2 = read_image(relpath('externals/im5.jpg'), 2)
-    mask = read_image(relpath('externals/im6.PNG'), 1) > 127/255
+    mask = read_image(relpath('externals/im6.png'), 1) > 127/255
 
     # define attributes
     max_levels, filter_size_im, filter_size_mask = 5, 5, 3
@@ -173,7 +247,7 @@ def blending_example2():
     # read images
     im1 = read_image(relpath('externals/im1.jpg'), 2)
     im2 = read_image(relpath('externals/im2.jpg'), 2)
-    mask = read_image(relpath('externals/im3.PNG'), 1) > 127/255
+    mask = read_image(relpath('externals/im3.png'), 1) > 127/255
 
     # define attributes
     max_levels, filter_size_im, filter_size_mask = 5, 5, 3
@@ -188,80 +262,312 @@ def blending_example2():
 # \\\\////\\\\////\\\\////\\\\////\\\\////#
 
 
-def expand_image(im, filter_vec):
+def expand_image(im, filter_vec, out=None):
     """
     the function expend reduced image by padding and blur
     :param im: the image to expend
     :param filter_vec: the vector to blur by it
+    :param out: optional array twice the size of im to write the result into
     :return: the image twice its size
     """
-    # pad image with zeros to twice the size
+    xp, ndi = get_backend(im)
     rows, cols = im.shape[0], im.shape[1]
-    expand_im = np.zeros([rows * 2, cols * 2])
-    expand_im[::2, ::2] = im
+    if out is None:
+        out = xp.empty((rows * 2, cols * 2) + im.shape[2:], dtype=np.float32)
+    elif out.shape[:2] != (rows * 2, cols * 2):  # the kernels below write without bounds checks
+        raise ValueError('out has shape %s, expected %s' % (out.shape[:2], (rows * 2, cols * 2)))
+    if numba is not None and xp is np:  # upsample and blur in one pass, skipping the zeros
+        if _is_symmetric5(filter_vec):
+            _expand_polyphase5(_as_channels(im), *(filter_vec[:3] * 2), _as_channels(out))
+        else:
+            _expand_polyphase(_as_channels(im), filter_vec * 2, _as_channels(out))
+        return out
+
+    # instead of padding with zeros, even and odd output pixels each get their own share of the taps
+    phases = [(xp.asarray(taps), origin) for taps, origin in _polyphase_filters(filter_vec * 2)]
 
     # blur image each polarization
-    expand_im = convolve(expand_im, filter_vec * 2)
-    expand_im = convolve(expand_im, filter_vec.transpose() * 2)
-    return expand_im
+    expand_im = xp.empty((rows, cols * 2) + im.shape[2:], dtype=np.float32)
+    for parity, (taps, origin) in enumerate(phases):
+        ndi.correlate1d(im, taps, axis=1, output=expand_im[:, parity::2], mode='reflect', origin=origin)
+    for parity, (taps, origin) in enumerate(phases):
+        ndi.correlate1d(expand_im, taps, axis=0, output=out[parity::2], mode='reflect', origin=origin)
+    return out
 
 
-def reduce_image(im, filter_vec, i):
+def reduce_image(im, filter_vec):
     """
     the function reduces the image size by two. blur before resizing.
-    :param im: original image
+    :param im: image to reduce
     :param filter_vec: vector to filter by
     :return: image size down by half
     """
-    #   blur
-    reduced_im = convolve(im, filter_vec)
-    reduced_im = convolve(reduced_im, filter_vec.transpose())
+    xp, ndi = get_backend(im)
+    if numba is not None and xp is np:  # blur only the pixels that survive the re-size
+        if _is_symmetric5(filter_vec):
+            reduced_im = _reduce_polyphase5(_as_channels(im), *filter_vec[:3])
+        else:
+            reduced_im = _reduce_polyphase(_as_channels(im), filter_vec)
+        return reduced_im.reshape(reduced_im.shape[:2] + im.shape[2:])
+
+    #   blur and re-size, dropping rows before the second pass so it only blurs the rows that are kept
+    filter_vec = xp.asarray(filter_vec)
+    reduced_im = ndi.convolve1d(im, filter_vec, axis=0, mode='reflect')[::2]
+    reduced_im = ndi.convolve1d(reduced_im, filter_vec, axis=1, mode='reflect')[:, ::2]
+
+    # copy out of the full width buffer, a strided view would keep all of it alive with the level
+    return xp.ascontiguousarray(reduced_im)
+
+
+def get_backend(im):
+    """
+    pick the array module and ndimage matching where the image lives
+    :param im: numpy or cupy array
+    :return: cupy and cupyx.scipy.ndimage for gpu arrays, numpy and scipy.ndimage otherwise
+    """
+    if cupy is not None and isinstance(im, cupy.ndarray):
+        return cupy, cupy_ndimage
+    return np, ndimage
+
+
+def _correlate1d_numpy(im, weights, axis=-1, output=None, mode='reflect', origin=0):
+    """
+    numpy only stand in for scipy.ndimage.correlate1d, supports the 'reflect' mode only.
+    every window along axis is a strided view of the padded image, so no copies are made
+    """
+    if mode != 'reflect':
+        raise ValueError("only the 'reflect' mode is supported without scipy, got %r" % mode)
+    size = len(weights)
+    before = size // 2 + origin
+    pad = [(0, 0)] * im.ndim
+    pad[axis] = (before, size - 1 - before)
+    padded = np.pad(im, pad, mode='symmetric')  # numpy 'symmetric' is ndimage 'reflect'
+    windows = np.moveaxis(sliding_window_view(padded, size, axis=axis), -1, 0)
+    if output is None:
+        output = np.empty_like(im)
+    # same_kind lets float64 input land in a float32 output, as ndimage allows
+    return np.einsum('k...,k->...', windows, np.asarray(weights, dtype=im.dtype), out=output,
+                     casting='same_kind')
+
+
+def _convolve1d_numpy(im, weights, axis=-1, output=None, mode='reflect', origin=0):
+    """
+    numpy only stand in for scipy.ndimage.convolve1d, a correlation with the flipped weights
+    """
+    origin = -origin - (1 - len(weights) % 2)  # the same shift scipy applies to even sizes
+    return _correlate1d_numpy(im, weights[::-1], axis, output, mode, origin)
+
+
+if ndimage is None:
+    ndimage = SimpleNamespace(correlate1d=_correlate1d_numpy, convolve1d=_convolve1d_numpy)
+
+
+def _polyphase_filters(filter_vec):
+    """
+    split an upsampling filter into the taps that reach the even and the odd output pixels.
+    output pixel 2i + p is then a correlation of the source around pixel i
+    :param filter_vec: the vector to blur by it, of any size
+    :return: (taps, origin) for p = 0 and p = 1, as used by correlate1d
+    """
+    half = len(filter_vec) // 2
+    phases = []
+    for parity in range(2):
+        first = (parity + half) % 2
+        taps = np.ascontiguousarray(filter_vec[first::2][::-1])
+        lowest = (parity + half - first) // 2 - (len(taps) - 1)  # source offset of taps[0]
+        if len(taps) == 0:  # a 1 tap filter never reaches the odd pixels
+            taps, lowest = np.zeros(1, dtype=filter_vec.dtype), 0
+        origin = -lowest - len(taps) // 2
+        if not 0 <= len(taps) // 2 + origin < len(taps):
+            # the shift is out of the range correlate1d accepts, pad with zeros to centre the taps
+            reach = max(-lowest, lowest + len(taps) - 1)
+            centred = np.zeros(2 * reach + 1, dtype=taps.dtype)
+            centred[reach + lowest:reach + lowest + len(taps)] = taps
+            taps, origin = centred, 0
+        phases.append((taps, origin))
+    return phases
+
+
+def _is_symmetric5(filter_vec):
+    """
+    the 5 tap kernels fold the mirrored taps together, as in [1, 4, 6, 4, 1] / 16 of make_filter_to_size
+    """
+    return len(filter_vec) == 5 and filter_vec[0] == filter_vec[4] and filter_vec[1] == filter_vec[3]
 
-    #   re-size
-    reduced_im = reduced_im[::2 ** i, ::2 ** i]
 
-    return reduced_im
+def _as_channels(im):
+    """
+    view a grayscale image as a single channel image, so the kernels always get (rows, cols, channels)
+    """
+    return im[:, :, np.newaxis] if im.ndim == 2 else im
+
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _reflect_index(i, n):
+        """
+        map index i into [0, n) the same way 'reflect' mode of scipy.ndimage does (d c b a | a b c d)
+        """
+        i = i % (2 * n)
+        return i if i < n else 2 * n - 1 - i
+
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _expand_polyphase(src, filter_vec, expand_im):
+        """
+        upsample src to twice its size and blur with filter_vec on both axes, only the taps that
+        fall on a source pixel are accumulated. borders reflect src, the same as the scipy path
+        of expand_image. the result goes to expand_im
+        """
+        rows, cols, channels = src.shape
+        size = filter_vec.shape[0]
+        half = size // 2
+        out_rows, out_cols = rows * 2, cols * 2
+
+        # horizontal pass, only the source rows, the odd rows of the upsampled image are all zeros
+        blurred = np.zeros((rows, out_cols, channels), dtype=src.dtype)
+        for y in numba.prange(rows):
+            for x in range(out_cols):
+                for t in range(size):
+                    j = x + half - t
+                    if j % 2 == 0:
+                        xs = _reflect_index(j // 2, cols)
+                        for c in range(channels):
+                            blurred[y, x, c] += filter_vec[t] * src[y, xs, c]
+
+        # vertical pass
+        for y in numba.prange(out_rows):
+            expand_im[y] = 0
+            for t in range(size):
+                j = y + half - t
+                if j % 2 == 0:
+                    ys = _reflect_index(j // 2, rows)
+                    for x in range(out_cols):
+                        for c in range(channels):
+                            expand_im[y, x, c] += filter_vec[t] * blurred[ys, x, c]
+
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _reduce_polyphase(src, filter_vec):
+        """
+        same as convolving src with filter_vec on both axes and taking every second pixel,
+        but the dropped pixels are never computed
+        """
+        rows, cols, channels = src.shape
+        size = filter_vec.shape[0]
+        half = size // 2
+        out_rows, out_cols = (rows + 1) // 2, (cols + 1) // 2
+
+        # horizontal pass, even columns only
+        blurred = np.zeros((rows, out_cols, channels), dtype=src.dtype)
+        for y in numba.prange(rows):
+            for x in range(out_cols):
+                for t in range(size):
+                    xs = _reflect_index(2 * x + half - t, cols)
+                    for c in range(channels):
+                        blurred[y, x, c] += filter_vec[t] * src[y, xs, c]
+
+        # vertical pass, even rows only
+        reduced_im = np.zeros((out_rows, out_cols, channels), dtype=src.dtype)
+        for y in numba.prange(out_rows):
+            for t in range(size):
+                ys = _reflect_index(2 * y + half - t, rows)
+                for x in range(out_cols):
+                    for c in range(channels):
+                        reduced_im[y, x, c] += filter_vec[t] * blurred[ys, x, c]
+        return reduced_im
+
+    # specialized versions for the symmetric 5 tap filter [c0, c1, c2, c1, c0] used by the examples,
+    # the taps are unrolled and each mirrored pair costs a single multiply
+
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _expand_polyphase5(src, c0, c1, c2, expand_im):
+        """
+        _expand_polyphase for [c0, c1, c2, c1, c0]. even output pixels see the taps c0, c2, c0
+        and odd output pixels see c1, c1
+        """
+        rows, cols, channels = src.shape
+
+        # horizontal pass
+        blurred = np.empty((rows, cols * 2, channels), dtype=src.dtype)
+        for y in numba.prange(rows):
+            for x in range(cols):
+                left, right = _reflect_index(x - 1, cols), _reflect_index(x + 1, cols)
+                for c in range(channels):
+                    blurred[y, 2 * x, c] = c0 * (src[y, left, c] + src[y, right, c]) + c2 * src[y, x, c]
+                    blurred[y, 2 * x + 1, c] = c1 * (src[y, x, c] + src[y, right, c])
+
+        # vertical pass
+        for y in numba.prange(rows):
+            up, down = _reflect_index(y - 1, rows), _reflect_index(y + 1, rows)
+            for x in range(cols * 2):
+                for c in range(channels):
+                    expand_im[2 * y, x, c] = (c0 * (blurred[up, x, c] + blurred[down, x, c])
+                                              + c2 * blurred[y, x, c])
+                    expand_im[2 * y + 1, x, c] = c1 * (blurred[y, x, c] + blurred[down, x, c])
+
+    @numba.njit(parallel=True, cache=True, fastmath=True)
+    def _reduce_polyphase5(src, c0, c1, c2):
+        """
+        _reduce_polyphase for [c0, c1, c2, c1, c0]
+        """
+        rows, cols, channels = src.shape
+        out_rows, out_cols = (rows + 1) // 2, (cols + 1) // 2
+
+        # horizontal pass, even columns only
+        blurred = np.empty((rows, out_cols, channels), dtype=src.dtype)
+        for y in numba.prange(rows):
+            for x in range(out_cols):
+                x2, x1 = _reflect_index(2 * x - 2, cols), _reflect_index(2 * x - 1, cols)
+                x3, x4 = _reflect_index(2 * x + 1, cols), _reflect_index(2 * x + 2, cols)
+                for c in range(channels):
+                    blurred[y, x, c] = (c0 * (src[y, x2, c] + src[y, x4, c])
+                                        + c1 * (src[y, x1, c] + src[y, x3, c])
+                                        + c2 * src[y, 2 * x, c])
+
+        # vertical pass, even rows only
+        reduced_im = np.empty((out_rows, out_cols, channels), dtype=src.dtype)
+        for y in numba.prange(out_rows):
+            y2, y1 = _reflect_index(2 * y - 2, rows), _reflect_index(2 * y - 1, rows)
+            y3, y4 = _reflect_index(2 * y + 1, rows), _reflect_index(2 * y + 2, rows)
+            for x in range(out_cols):
+                for c in range(channels):
+                    reduced_im[y, x, c] = (c0 * (blurred[y2, x, c] + blurred[y4, x, c])
+                                           + c1 * (blurred[y1, x, c] + blurred[y3, x, c])
+                                           + c2 * blurred[2 * y, x, c])
+        return reduced_im
 
 
 def read_image(filename, representation):
     """
     :param filename: the file name of the image to open
     :param representation: 1 for grayscale format, 2 for RGB format
-    :return: image as float 64 in the selected format
+    :return: image as float 32 in the selected format
     """
-    im = imread(filename).astype(np.float64)
-    im = sk.rgb2gray(im)/255 if representation == 1 else im / 255
+    # convert so palette, alpha and grayscale files all come out as (rows, cols, 3)
+    with Image.open(filename) as img:
+        im = np.asarray(img.convert('RGB'))
+    im = np.multiply(im, np.float32(1 / 255), dtype=np.float32)  # one pass straight from uint8
+    if representation == 1:  # luminance, same weights as rgb2gray of matlab
+        im = (np.float32(0.2989) * im[..., 0] + np.float32(0.5870) * im[..., 1]
+              + np.float32(0.1140) * im[..., 2])
     return im
 
 
+@functools.lru_cache(maxsize=32)
 def make_filter_to_size(size):
     """
-    make a filter mask to size as an image
+    make a 1D binomial blur filter to size. the result is cached, so it is returned read-only
     :param size: the size of desired mask
-    :return: the filter in the stated size, normalized
+    :return: the filter in the stated size as a 1D array, normalized
     """
-    # make blur mask filter based on the vector and kernel size
-    blur_vector = np.matrix(np.array([1, 1]))
-    blur_mask = c2d(blur_vector, blur_vector)  # initial mask
-
-    for i in range(size - 3):  # up-size mask to kernel size
-        blur_mask = c2d(blur_mask, blur_vector)
+    # binomial coefficients, the same as convolving [1, 1] with itself size - 1 times
+    blur_mask = np.array([math.comb(size - 1, k) for k in range(size)], dtype=np.float64)
 
     # normalize filter
-    blur_mask = blur_mask / np.sum(blur_mask)
+    blur_mask = (blur_mask / blur_mask.sum()).astype(np.float32)
+    blur_mask.flags.writeable = False
     return blur_mask
 
 
-def norm_pyramid(pyr):
-    """
-    normalize pyramid values
-    :param pyr: pyramid
-    :return: normalized pyramid
-    """
-    max_pixel, min_pixel = np.nanmax(pyr), np.nanmin(pyr)
-    return (pyr - min_pixel) / (max_pixel - min_pixel)
-
-
 def relpath(filename):
     """
     function from ex to upload images
@@ -269,13 +575,21 @@ def relpath(filename):
     return os.path.join(os.path.dirname(__file__), filename)
 
 
-def blend_RGB(im1, im2, mask, max_levels, filter_size_im, filter_size_mask):
-    im_blend = np.zeros((im1.shape[0], im1.shape[1], 3)).astype(np.float64)
-    for i in range(3):
-        im_blend[:, :, i] = pyramid_blending(im1[:, :, i], im2[:, :, i], mask, max_levels, filter_size_im,
-                                             filter_size_mask)
-
-    display_blend(im1, im2, mask, im_blend)
+def blend_RGB(im1, im2, mask, max_levels, filter_size_im, filter_size_mask, use_gpu=False):
+    """
+    blend all 3 channels at once, the 1D passes leave the channel axis untouched
+    so the mask pyramid is built only once. with use_gpu the images are moved to the gpu
+    once, blended there with cupy and only the result is copied back
+    """
+    if use_gpu:
+        if cupy is None:
+            raise ImportError('use_gpu requires cupy')
+        im_blend = pyramid_blending(cupy.asarray(im1[:, :, :3]), cupy.asarray(im2[:, :, :3]),
+                                    cupy.asarray(mask), max_levels, filter_size_im, filter_size_mask)
+        im_blend = cupy.asnumpy(im_blend)
+    else:
+        im_blend = pyramid_blending(im1[:, :, :3], im2[:, :, :3], mask, max_levels, filter_size_im,
+                                    filter_size_mask)
     return im_blend
 
 
@@ -299,6 +613,6 @@ def display_blend(im1, im2, mask, im_blend):
     plt.show()
 
 
-#blending_example1()
-
-blending_example2()
\ No newline at end of file
+if __name__ == '__main__':
+    # display_blend(*blending_example1())
+    display_blend(*blending_example2())
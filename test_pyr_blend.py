@@ -0,0 +1,168 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import pyr_blend
+
+ndimage = pytest.importorskip('scipy.ndimage')
+
+numpy_ndimage = SimpleNamespace(correlate1d=pyr_blend._correlate1d_numpy,
+                                convolve1d=pyr_blend._convolve1d_numpy)
+
+# name: (numba module or None, ndimage implementation)
+BACKENDS = {'scipy': (None, ndimage), 'numpy': (None, numpy_ndimage)}
+if pyr_blend.numba is not None:
+    BACKENDS['numba'] = (pyr_blend.numba, ndimage)
+
+
+def use_backend(monkeypatch, name):
+    numba, ndimage_impl = BACKENDS[name]
+    monkeypatch.setattr(pyr_blend, 'numba', numba)
+    monkeypatch.setattr(pyr_blend, 'ndimage', ndimage_impl)
+
+
+def random_image(shape):
+    return np.random.default_rng(0).random(shape, dtype=np.float32)
+
+
+def zero_insert_expand(im, filter_vec):
+    """
+    the textbook expand: pad with zeros to twice the size and blur, independent of pyr_blend
+    """
+    filter_vec = 2 * np.asarray(filter_vec)
+    expand_im = np.zeros((im.shape[0] * 2, im.shape[1] * 2) + im.shape[2:])
+    expand_im[::2, ::2] = im
+    expand_im = ndimage.convolve1d(expand_im, filter_vec, axis=1, mode='reflect')
+    return ndimage.convolve1d(expand_im, filter_vec, axis=0, mode='reflect')
+
+
+def blur_and_decimate(im, filter_vec):
+    """
+    the textbook reduce: blur on both axes and take every second pixel
+    """
+    filter_vec = np.asarray(filter_vec)
+    blurred = ndimage.convolve1d(im, filter_vec, axis=1, mode='reflect')
+    return ndimage.convolve1d(blurred, filter_vec, axis=0, mode='reflect')[::2, ::2]
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+@pytest.mark.parametrize('filter_size', [1, 2, 3, 4, 5, 7])
+@pytest.mark.parametrize('shape', [(64, 48), (64, 48, 3)])
+def test_matches_reference(monkeypatch, name, filter_size, shape):
+    use_backend(monkeypatch, name)
+    im = random_image(shape)
+    filter_vec = pyr_blend.make_filter_to_size(filter_size)
+
+    reduced = pyr_blend.reduce_image(im, filter_vec)
+    np.testing.assert_allclose(reduced, blur_and_decimate(im, filter_vec), atol=1e-5)
+
+    # the borders only depend on how the image is extended, compare the interior
+    m = filter_size
+    expanded = pyr_blend.expand_image(im, filter_vec)
+    np.testing.assert_allclose(expanded[m:-m, m:-m], zero_insert_expand(im, filter_vec)[m:-m, m:-m],
+                               atol=1e-5)
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+@pytest.mark.parametrize('filter_size', [1, 2, 3, 4, 5, 7])
+@pytest.mark.parametrize('shape', [(64, 48), (64, 48, 3)])
+def test_backends_agree(monkeypatch, name, filter_size, shape):
+    im = random_image(shape)
+    filter_vec = pyr_blend.make_filter_to_size(filter_size)
+
+    use_backend(monkeypatch, 'scipy')
+    reduced = pyr_blend.reduce_image(im, filter_vec)
+    expanded = pyr_blend.expand_image(im, filter_vec)
+    lpyr, _ = pyr_blend.build_laplacian_pyramid(im, 3, filter_size)
+    # float64 coefficients, as in the original call form
+    collapsed = pyr_blend.laplacian_to_image(lpyr, filter_vec, np.ones(len(lpyr)))
+
+    use_backend(monkeypatch, name)
+    np.testing.assert_allclose(pyr_blend.reduce_image(im, filter_vec), reduced, atol=1e-5)
+    np.testing.assert_allclose(pyr_blend.expand_image(im, filter_vec), expanded, atol=1e-5)
+    lpyr, _ = pyr_blend.build_laplacian_pyramid(im, 3, filter_size)
+    result = pyr_blend.laplacian_to_image(lpyr, filter_vec, np.ones(len(lpyr)))
+    np.testing.assert_allclose(result, collapsed, atol=1e-5)
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_laplacian_round_trip(monkeypatch, name):
+    use_backend(monkeypatch, name)
+    im = random_image((64, 64, 3))
+    original = im.copy()
+    lpyr, filter_vec = pyr_blend.build_laplacian_pyramid(im, 4, 5)
+    np.testing.assert_array_equal(im, original)  # the input is never used as scratch
+    result = pyr_blend.laplacian_to_image(lpyr, filter_vec, np.ones(len(lpyr), dtype=np.float32))
+    np.testing.assert_allclose(result, original, atol=1e-5)
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_expand_rejects_wrong_out_shape(monkeypatch, name):
+    use_backend(monkeypatch, name)
+    im = random_image((17, 32))
+    with pytest.raises(ValueError):
+        pyr_blend.expand_image(im, pyr_blend.make_filter_to_size(5), out=np.empty((33, 64), np.float32))
+
+
+def test_read_image(tmp_path):
+    from PIL import Image
+    pixels = (np.arange(4 * 6 * 3).reshape(4, 6, 3) * 3).astype(np.uint8)
+    path = str(tmp_path / 'im.png')
+    Image.fromarray(pixels).save(path)
+
+    rgb = pyr_blend.read_image(path, 2)
+    assert rgb.dtype == np.float32 and rgb.shape == (4, 6, 3)
+    np.testing.assert_allclose(rgb, pixels / 255, atol=1e-6)
+
+    gray = pyr_blend.read_image(path, 1)
+    expected = (0.2989 * pixels[..., 0] + 0.5870 * pixels[..., 1] + 0.1140 * pixels[..., 2]) / 255
+    assert gray.dtype == np.float32 and gray.shape == (4, 6)
+    np.testing.assert_allclose(gray, expected, atol=1e-5)
+
+    # grayscale files still come out with 3 channels
+    Image.fromarray(pixels[..., 0]).save(path)
+    np.testing.assert_allclose(pyr_blend.read_image(path, 2), np.repeat(pixels[..., :1] / 255, 3, axis=2),
+                               atol=1e-6)
+
+
+def test_render_pyramid():
+    pyr = [random_image((8, 8)) * 4 - 2, random_image((4, 4)) + 3]
+    res = pyr_blend.render_pyramid(pyr, 5)  # more levels than the pyramid has
+    assert res.shape == (8, 12)
+    for level, view in zip(pyr, [res[:, :8], res[:4, 8:]]):
+        np.testing.assert_allclose(view, (level - level.min()) / (level.max() - level.min()), atol=1e-6)
+    assert not res[4:, 8:].any()  # black below the smaller level
+
+
+def test_blend_rgb_gpu_requires_cupy(monkeypatch):
+    monkeypatch.setattr(pyr_blend, 'cupy', None)
+    im = random_image((32, 32, 3))
+    with pytest.raises(ImportError):
+        pyr_blend.blend_RGB(im, im, np.ones((32, 32), bool), 3, 5, 3, use_gpu=True)
+
+
+@pytest.mark.parametrize('name', sorted(BACKENDS))
+def test_blend_with_constant_masks(monkeypatch, name):
+    use_backend(monkeypatch, name)
+    im1, im2 = random_image((64, 64, 3)), random_image((64, 64, 3))[::-1].copy()
+    copies = im1.copy(), im2.copy()
+    for mask, expected in [(np.ones((64, 64), bool), im1), (np.zeros((64, 64), bool), im2)]:
+        im_blend = pyr_blend.pyramid_blending(im1, im2, mask, 4, 5, 3)
+        np.testing.assert_allclose(im_blend, expected, atol=1e-5)
+    # the caller's images are never used as scratch
+    np.testing.assert_array_equal(im1, copies[0])
+    np.testing.assert_array_equal(im2, copies[1])
+
+
+@pytest.mark.parametrize('shape, max_levels, depth', [((64, 64), 10, 3), ((17, 300), 10, 1),
+                                                      ((512, 256), 3, 3), ((8, 8), 5, 1)])
+def test_gaussian_depth(shape, max_levels, depth):
+    pyr, _ = pyr_blend.build_gaussian_pyramid(random_image(shape), max_levels, 5)
+    assert len(pyr) == depth
+    assert all(min(level.shape) >= pyr_blend.LOWEST_RES for level in pyr[1:])
+
+
+def test_numpy_fallback_rejects_other_modes():
+    with pytest.raises(ValueError):
+        pyr_blend._correlate1d_numpy(random_image((8, 8)), np.ones(3, np.float32), mode='constant')